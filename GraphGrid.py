@@ -1,33 +1,231 @@
 from typing import Optional, Tuple
+import heapq
 import math
-import matplotlib.pyplot as plt
-from matplotlib.patches import Patch
+import numpy as np
+import shapely
+from numba import njit
+from scipy.sparse import csr_matrix
+from scipy.sparse.csgraph import dijkstra
 from vectorGrid import VectorGrid
+from utils import plot_cells
 import networkx as nx
-from geopandas.tools import sjoin
+
+# Lattice offsets of the 8 neighbors of a cell
+NEIGHBOR_OFFSETS = [(-1, -1), (-1, 0), (-1, 1), (0, -1), (0, 1), (1, -1), (1, 0), (1, 1)]
+
+# Number of paths kept by GraphGrid.find_path
+PATH_CACHE_SIZE = 32
+
+# Relative margin the octile distance is shrunk by, larger than the rounding of float32 edge weights
+OCTILE_MARGIN = 1e-6
+
+# Empty landmark table for searches that only use the octile heuristic
+NO_LANDMARKS = np.zeros((0, 1))
+
+
+@njit(cache=True)
+def octile_distance(xy, a, b, cell_size):
+    """
+    Returns the octile distance between two cells, the length of the shortest
+    8-connected route between them when no cell is blocked.
+
+    The edge weights are stored as float32, which can round a diagonal step
+    below cell_size * sqrt(2). The distance is shrunk by OCTILE_MARGIN to stay
+    below those rounded costs, so it never overestimates the path cost and is
+    consistent, and A* using it as heuristic expands every node at most once.
+
+    Parameters:
+    xy (ndarray): The (ix, iy) lattice position of every node, shape (N, 2).
+    a (int): The ID of the first node.
+    b (int): The ID of the second node.
+    cell_size (float): The size of each cell in the grid.
+
+    Returns:
+    float: The octile distance in meters.
+    """
+    dx = abs(xy[a, 0] - xy[b, 0])
+    dy = abs(xy[a, 1] - xy[b, 1])
+    return (1 - OCTILE_MARGIN) * cell_size * (max(dx, dy) + (math.sqrt(2) - 1) * min(dx, dy))
+
+
+@njit(cache=True)
+def landmark_distance(landmarks, a, b):
+    """
+    Returns the ALT lower bound of the path cost between two nodes.
+
+    By the triangle inequality, the difference of the distances of two nodes
+    to any landmark never exceeds the distance between the nodes.
+
+    Parameters:
+    landmarks (ndarray): The shortest path cost from every landmark to every node, shape (K, N).
+    a (int): The ID of the first node.
+    b (int): The ID of the second node.
+
+    Returns:
+    float: The largest bound over all landmarks, inf if the nodes are not connected.
+    """
+    bound = 0.0
+    for k in range(landmarks.shape[0]):
+        da, db = landmarks[k, a], landmarks[k, b]
+        if da != db:  # Also skips nodes that both cannot reach the landmark
+            bound = max(bound, abs(da - db))
+    return bound
+
+
+@njit(cache=True)
+def astar_csr(indptr, indices, weights, xy, cell_size, landmarks, start, end):
+    """
+    Runs A* over a graph stored as CSR adjacency arrays.
+
+    The larger of the octile distance and the landmark bound to the end node
+    is used as heuristic.
+
+    Parameters:
+    indptr (ndarray): Offsets into indices/weights for every node, shape (N+1,).
+    indices (ndarray): The neighbor of every edge, shape (E,).
+    weights (ndarray): The weight of every edge, shape (E,).
+    xy (ndarray): The (ix, iy) lattice position of every node, shape (N, 2).
+    cell_size (float): The size of each cell in the grid.
+    landmarks (ndarray): The shortest path cost from every landmark to every node, shape (K, N).
+    start (int): The ID of the start node.
+    end (int): The ID of the end node.
+
+    Returns:
+    ndarray: The parent of every node on the search tree, -1 if it was not reached.
+    """
+    n = len(indptr) - 1
+    cost = np.full(n, np.inf)
+    parent = np.full(n, -1, dtype=np.int64)
+    closed = np.zeros(n, dtype=np.bool_)
+    cost[start] = 0.0
+    heap = [(octile_distance(xy, start, end, cell_size), np.int64(start))]
+    while len(heap) > 0:
+        _, node = heapq.heappop(heap)
+        if closed[node]:
+            continue
+        if node == end:
+            break
+        closed[node] = True
+        for k in range(indptr[node], indptr[node + 1]):
+            neighbor = np.int64(indices[k])
+            if closed[neighbor]:
+                continue
+            new_cost = cost[node] + weights[k]
+            if new_cost < cost[neighbor]:
+                cost[neighbor] = new_cost
+                parent[neighbor] = node
+                h = max(octile_distance(xy, neighbor, end, cell_size), landmark_distance(landmarks, neighbor, end))
+                if h < np.inf:  # Nodes that cannot reach the end node are never expanded
+                    heapq.heappush(heap, (new_cost + h, neighbor))
+    return parent
+
 
 class GraphGrid:
     """
     The GraphGrid class is used to create a graph from a grid of geographical data.
-    It uses networkx to create the graph and geopandas for spatial operations.
+    The graph is stored as CSR adjacency arrays indexed by cell ID; a networkx
+    view of it is only built when the graph attribute is accessed.
     """
-    def __init__(self, grid):
+    def __init__(self, grid, cell_size):
         """
         Initializes a GraphGrid instance.
         
         Parameters:
         grid (GeoDataFrame): A GeoDataFrame representing the grid.
+        cell_size (int): The size of each cell in the grid.
         """
         self.grid = grid
-        self.graph = self.create_graph()
+        self.cell_size = cell_size
+        self.obstacle_epoch = grid.attrs.get('obstacle_epoch', 0)
+        self._build()
+        self._path_cache = {}
         self.start_id = None
         self.end_id = None
         self.path = None
 
+    def _build(self):
+        """Builds the CSR arrays from the passable cells of the grid and drops everything derived from the old ones."""
+        self.passable_mask = np.zeros(self.grid['id'].max() + 1, dtype=bool)
+        self.passable_mask[self.grid['id'].to_numpy()] = self.grid['passable'].to_numpy(dtype=bool)
+        self.indptr, self.indices, self.weights, self.xy = self._build_csr()
+        self._graph = None
+        self._lm_dist = None
+        self._searches = 0
+
+    @property
+    def graph(self):
+        """networkx.Graph: The grid as networkx graph, built on first access."""
+        self._sync_obstacles()
+        if self._graph is None:
+            self._graph = self.create_graph()
+        return self._graph
+
+    def has_node(self, node):
+        """Returns True if the node is a passable cell of the graph."""
+        self._sync_obstacles()
+        return 0 <= node < len(self.passable_mask) and bool(self.passable_mask[node])
+
+    def number_of_nodes(self):
+        """Returns the number of passable cells in the graph."""
+        self._sync_obstacles()
+        return int(self.passable_mask.sum())
+
+    def number_of_edges(self):
+        """Returns the number of adjacencies between passable cells."""
+        self._sync_obstacles()
+        return len(self.indices) // 2
+
+    def _sync_obstacles(self):
+        """
+        Rebuilds the graph if the obstacles of the grid changed since it was built.
+        Every public accessor calls it first, so none of them reports stale cells.
+
+        Cached paths stay valid if cells were only blocked away from them: blocking
+        cells never makes another path shorter. Any cell that became passable
+        could open a shortcut, so then the whole cache is dropped.
+        """
+        epoch = self.grid.attrs.get('obstacle_epoch', 0)
+        if epoch == self.obstacle_epoch:
+            return
+        old_mask = self.passable_mask
+        self._build()
+        opened = np.flatnonzero(self.passable_mask & ~old_mask)
+        blocked = np.flatnonzero(~self.passable_mask & old_mask)
+        if len(opened):
+            self._path_cache = {}
+        else:
+            self._path_cache = {(start_id, end_id, epoch): path
+                                for (start_id, end_id, _), path in self._path_cache.items()
+                                if not np.isin(path, blocked).any()}
+        self.obstacle_epoch = epoch
+
+    def _cached_path(self, start_id, end_id):
+        """
+        Looks up the path from start to end in the path cache.
+
+        Every section of a shortest path is itself a shortest path, so a cached
+        path that passes both nodes answers the query as well.
+        
+        Returns:
+        ndarray, optional: The cached path, or None if no cached path covers both nodes.
+        """
+        path = self._path_cache.get((start_id, end_id, self.obstacle_epoch))
+        if path is not None:
+            return path.copy()
+        for path in reversed(self._path_cache.values()):
+            i, j = np.flatnonzero(path == start_id), np.flatnonzero(path == end_id)
+            if len(i) and len(j):
+                i, j = i[0], j[0]
+                return path[i:j + 1].copy() if i <= j else path[j:i + 1][::-1].copy()
+        return None
+
     def create_graph(self):
         """
         Creates a graph from the grid where each node represents a cell in the grid 
         and each edge represents adjacency between two cells.
+
+        The cells lie on a regular lattice, so the neighbors of a cell are found
+        from its (ix, iy) lattice position instead of a spatial join.
         
         Returns:
         networkx.Graph: A graph representing the grid.
@@ -35,48 +233,171 @@ class GraphGrid:
         # Create an empty graph
         G = nx.Graph()
 
-        # Add a node for each cell in the grid
-        for index, row in self.grid.iterrows():
-            if row['passable']:
-                G.add_node(row['id'], geometry=row['geometry'])
+        # Add a node for each passable cell
+        passable = self.grid[self.grid['passable']]
+        G.add_nodes_from((cell_id, {'geometry': geometry}) for cell_id, geometry in zip(passable['id'], passable['geometry']))
+
+        # Add an edge between each cell and each of its passable neighbors
+        src = np.repeat(np.arange(len(self.indptr) - 1), np.diff(self.indptr))
+        G.add_weighted_edges_from(zip(src.tolist(), self.indices.tolist(), self.weights.tolist()))
 
-        # Create a new GeoDataFrame that includes slightly expanded versions of each cell
-        grid_expanded = self.grid.copy()
-        grid_expanded['geometry'] = grid_expanded['geometry'].buffer(1)  # Adjust the buffer distance as needed
+        return G
 
-        # Perform a spatial join between the original grid and the expanded grid
-        joined = sjoin(self.grid, grid_expanded, how='inner', op='intersects')
+    def _neighbor_pairs(self):
+        """
+        Finds every pair of passable neighbor cells from their (ix, iy) lattice positions.
 
-        # For each cell in the original grid, add an edge between the cell and each of its neighbors
-        for cell_id, neighbors in joined.groupby('id_left'):
-            if cell_id in G.nodes:  # Check if the cell is in the graph
-                for neighbor_id in neighbors['id_right']:
-                    if cell_id != neighbor_id and neighbor_id in G.nodes:  # Exclude the cell itself and non-passable neighbors
-                        # Calculate the weight as the Euclidean distance between the centers of the two cells
-                        weight = G.nodes[cell_id]['geometry'].centroid.distance(G.nodes[neighbor_id]['geometry'].centroid)
-                        G.add_edge(cell_id, neighbor_id, weight=weight)
+        Returns:
+        tuple: source IDs, target IDs and weights of the edges as numpy arrays.
+        Every adjacency is listed in both directions.
+        """
+        ids = self.grid['id'].to_numpy()
+        ix = self.grid['ix'].to_numpy()
+        iy = self.grid['iy'].to_numpy()
+        passable = np.flatnonzero(self.grid['passable'].to_numpy(dtype=bool))
 
-        return G
+        # Lookup table from lattice position to row, padded by one so every offset stays in bounds
+        lookup = np.full((ix.max() + 3, iy.max() + 3), -1, dtype=np.int32)
+        lookup[ix[passable] + 1, iy[passable] + 1] = passable
 
-    def find_path(self, start_id, end_id):
+        src, dst = [], []
+        for dx, dy in NEIGHBOR_OFFSETS:
+            neighbor = lookup[ix[passable] + 1 + dx, iy[passable] + 1 + dy]
+            found = neighbor >= 0
+            src.append(passable[found])
+            dst.append(neighbor[found])
+        src, dst = np.concatenate(src), np.concatenate(dst)
+
+        # Clipped cells can lose contact with their lattice neighbors, keep those pairs only if
+        # the cells still lie within 1 m of each other
+        geometry = np.asarray(self.grid.geometry.values)
+        clipped = shapely.area(geometry) < self.cell_size ** 2 * (1 - 1e-6)
+        check = clipped[src] | clipped[dst]
+        keep = ~check
+        keep[check] = shapely.dwithin(geometry[src[check]], geometry[dst[check]], 1)
+        src, dst = src[keep], dst[keep]
+
+        # The weight is the Euclidean distance between the centers of the two cells
+        center_x = self.grid['center_x'].to_numpy()
+        center_y = self.grid['center_y'].to_numpy()
+        weights = np.hypot(center_x[src] - center_x[dst], center_y[src] - center_y[dst])
+        return ids[src], ids[dst], weights
+
+    def _build_csr(self):
+        """
+        Builds CSR adjacency arrays of the passable cells.
+
+        Returns:
+        tuple: indptr (N+1,) int32, indices (E,) int32, weights (E,) float32 and xy (N, 2) int32
+        arrays, indexed by cell ID.
+        """
+        ids = self.grid['id'].to_numpy()
+        n = ids.max() + 1
+
+        xy = np.zeros((n, 2), dtype=np.int32)
+        xy[ids, 0] = self.grid['ix'].to_numpy()
+        xy[ids, 1] = self.grid['iy'].to_numpy()
+
+        # Group the edges by their source node
+        src, dst, weights = self._neighbor_pairs()
+        order = np.argsort(src, kind='stable')
+        indptr = np.zeros(n + 1, dtype=np.int32)
+        np.cumsum(np.bincount(src, minlength=n), out=indptr[1:])
+        return indptr, dst[order].astype(np.int32), weights[order].astype(np.float32), xy
+
+    def _precompute_landmarks(self, k=8):
+        """
+        Picks up to k landmarks farthest-first and stores the shortest path cost
+        from each of them to every node, for the ALT heuristic of find_path.
+
+        Parameters:
+        k (int): The maximum number of landmarks.
+        
+        Returns:
+        ndarray: The shortest path cost from every landmark to every node, shape (K, N).
+        """
+        n = len(self.indptr) - 1
+        graph = csr_matrix((self.weights, self.indices, self.indptr), shape=(n, n))
+        passable = self.passable_mask
+        if not passable.any():
+            return np.zeros((0, n))
+
+        # Start from the node farthest away from an arbitrary passable node
+        dist = dijkstra(graph, directed=False, indices=np.flatnonzero(passable)[0])
+        candidate = int(np.argmax(np.where(np.isfinite(dist), dist, -1)))
+        closest = np.full(n, np.inf)
+        lm_dist = []
+        for _ in range(k):
+            dist = dijkstra(graph, directed=False, indices=candidate)
+            lm_dist.append(dist)
+            # The next landmark is the passable node farthest from all landmarks so far,
+            # which prefers nodes in components no landmark can reach yet
+            closest = np.minimum(closest, dist)
+            score = np.where(passable, closest, -1)
+            candidate = int(np.argmax(score))
+            if score[candidate] <= 0:
+                break
+        return np.array(lm_dist)
+
+    def heuristic(self, u, v):
+        """
+        Estimates the path cost between two nodes with the octile distance,
+        tightened by the landmark bound once landmarks are computed.
+        Can be passed as heuristic to nx.astar_path on self.graph.
+        
+        Parameters:
+        u (int): The ID of the first node.
+        v (int): The ID of the second node.
+        
+        Returns:
+        float: A lower bound of the path cost from u to v.
+        """
+        self._sync_obstacles()
+        bound = octile_distance(self.xy, u, v, float(self.cell_size))
+        if self._lm_dist is not None:
+            bound = max(bound, landmark_distance(self._lm_dist, u, v))
+        return bound
+
+    def find_path(self, start_id, end_id, landmarks=True):
         """
         Finds the shortest path from the start node to the end node using the A* algorithm.
+
+        Precomputing the landmarks costs several full Dijkstra runs, so they are only
+        built once a second search runs on the same graph; a single query never pays for them.
         
         Parameters:
         start_id (int): The ID of the start node.
         end_id (int): The ID of the end node.
+        landmarks (bool): Whether to use the ALT landmark bound once it pays off.
         
         Returns:
-        list, optional: A list of node IDs representing the shortest path from start to end. 
+        ndarray, optional: An int32 array of node IDs representing the shortest path from start to end. 
         If no path is found, returns None.
         """
-        if start_id not in self.graph.nodes:
+        self._sync_obstacles()
+        if not self.has_node(start_id):
             raise ValueError(f"Start point {start_id} is not in the graph.")
-        if end_id not in self.graph.nodes:
+        if not self.has_node(end_id):
             raise ValueError(f"End point {end_id} is not in the graph.")
         self.start_id = start_id
         self.end_id = end_id
-        self.path = nx.astar_path(self.graph, start_id, end_id, weight='weight')
+        self.path = self._cached_path(start_id, end_id)
+        if self.path is not None:
+            return self.path
+        if landmarks and self._lm_dist is None and self._searches > 0:
+            self._lm_dist = self._precompute_landmarks()
+        lm_dist = self._lm_dist if landmarks and self._lm_dist is not None else NO_LANDMARKS
+        self._searches += 1
+        parent = astar_csr(self.indptr, self.indices, self.weights, self.xy, float(self.cell_size), lm_dist, start_id, end_id)
+        if start_id == end_id or parent[end_id] >= 0:
+            # Walk the search tree back from the end node
+            path = [end_id]
+            while path[-1] != start_id:
+                path.append(parent[path[-1]])
+            self.path = np.array(path[::-1], dtype=np.int32)
+            self._path_cache[(start_id, end_id, self.obstacle_epoch)] = self.path.copy()
+            if len(self._path_cache) > PATH_CACHE_SIZE:
+                del self._path_cache[next(iter(self._path_cache))]
         return self.path
 
 
@@ -91,16 +412,18 @@ class GraphGrid:
         if self.path is None or self.start_id is None or self.end_id is None:
             raise ValueError("You must call find_path() before visualize_path().")
 
-        path_cells = self.grid[self.grid['id'].isin(self.path)]
-
+        import matplotlib.pyplot as plt
+        from matplotlib.patches import Patch
         fig, ax = plt.subplots()
-        if self.grid['passable'].any():  # If there are any passable cells
-            self.grid[self.grid['passable']].plot(ax=ax, color='green', edgecolor='black')
-        if (~self.grid['passable']).any():  # If there are any impassable cells
-            self.grid[~self.grid['passable']].plot(ax=ax, color='red', edgecolor='black')
-        path_cells.plot(ax=ax, color='blue', edgecolor='black')  # Plot path cells in blue
-        self.grid[self.grid['id'] == self.start_id].plot(ax=ax, color='gold', edgecolor='black')  # Plot start cell in gold
-        self.grid[self.grid['id'] == self.end_id].plot(ax=ax, color='magenta', edgecolor='black')  # Plot end cell in magenta 
+        colors = np.where(self.grid['passable'].to_numpy(dtype=bool), 'green', 'red').astype(object)
+        # Map cell IDs to rows of the grid
+        ids = self.grid['id'].to_numpy()
+        rows = np.empty(len(self.passable_mask), dtype=np.int64)
+        rows[ids] = np.arange(len(ids))
+        colors[rows[self.path]] = 'blue'  # Path cells in blue
+        colors[rows[self.start_id]] = 'gold'  # Start cell in gold
+        colors[rows[self.end_id]] = 'magenta'  # End cell in magenta
+        plot_cells(ax, self.grid.geometry.values, colors)
         legend_elements = [Patch(facecolor='green', edgecolor='black', label='Passable'),
                            Patch(facecolor='red', edgecolor='black', label='Impassable'),
                            Patch(facecolor='gold', edgecolor='black', label='Start'),
@@ -125,7 +448,7 @@ class GraphGrid:
 # vg.intersect()
 # vg.visualize()
 # # Create a GraphGrid from the VectorGrid's grid
-# gg = GraphGrid(vg.grid)
+# gg = GraphGrid(vg.grid, vg.cell_size)
 
 # print(vg.grid.head(500))
 
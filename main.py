@@ -1,15 +1,75 @@
 import warnings
 from vectorGrid import VectorGrid
 from GraphGrid import GraphGrid
+import argparse
 import os
+import time
+from concurrent.futures import ProcessPoolExecutor
 import geopandas as gpd
-import matplotlib.pyplot as plt
 from colorama import Fore, Style
 
-plt.ion()  # Turn on interactive mode
 warnings.filterwarnings('ignore')  # Ignore warnings
 
+def build_grid(boundary, obstacles, cell_size, rotation=None, intersect=False, clip=False):
+    """Generates a vector grid over the boundary, optionally intersected and/or clipped with it."""
+    vector_grid = VectorGrid(boundary, cell_size, rotation, obstacles)
+    if intersect:
+        vector_grid.intersect()
+    if clip:
+        vector_grid.clip()
+    return vector_grid
+
+def build_graph(boundary, obstacles, cell_size, rotation=None, intersect=False, clip=False):
+    """Generates the grid over the boundary and returns the graph built from it."""
+    vector_grid = build_grid(boundary, obstacles, cell_size, rotation, intersect, clip)
+    return GraphGrid(vector_grid.grid, cell_size)
+
+def solve(graph_grid, start_id, end_id, landmarks=True):
+    """
+    Returns the shortest path between two cells as an array of cell IDs, or None if there is none.
+    Pass landmarks=False when the graph only answers this one query.
+    """
+    return graph_grid.find_path(start_id, end_id, landmarks=landmarks)
+
+def run_query(boundary_path, obstacle_path, cell_size, start, end, rotation=None, intersect=False, clip=False):
+    """
+    Loads the boundary and obstacles and returns the path between the cells closest to
+    the UTM coordinates start and end, without prompting or plotting anything.
+    """
+    boundary = gpd.read_file(boundary_path, engine='pyogrio')
+    obstacles = gpd.read_file(obstacle_path, engine='pyogrio') if obstacle_path else None
+    vector_grid = build_grid(boundary, obstacles, cell_size, rotation, intersect, clip)
+    graph_grid = GraphGrid(vector_grid.grid, cell_size)
+    start_id, end_id = vector_grid.closest_cell_ids([start, end])
+    if start_id < 0 or end_id < 0:
+        raise ValueError('The start or end point is outside the boundary.')
+    return solve(graph_grid, int(start_id), int(end_id), landmarks=False)
+
+def benchmark_task(boundary_path, obstacle_path, cell_size):
+    """Builds the grid and graph and solves between the first and last passable cell. Returns the path length."""
+    boundary = gpd.read_file(boundary_path, engine='pyogrio')
+    obstacles = gpd.read_file(obstacle_path, engine='pyogrio') if obstacle_path else None
+    graph_grid = build_graph(boundary, obstacles, cell_size, intersect=True)
+    passable = graph_grid.grid.loc[graph_grid.grid['passable'], 'id']
+    path = solve(graph_grid, int(passable.iloc[0]), int(passable.iloc[-1]), landmarks=False)
+    return len(path) if path is not None else 0
+
+def benchmark(tasks, cell_size, workers=None):
+    """Runs independent grid and path queries on the demo data in parallel processes."""
+    demos = [('data/demo1_boundary.geojson', 'data/demo1_obstacles.geojson'),
+             ('data/demo2_boundary.geojson', 'data/demo2_obstacles.geojson')]
+    jobs = [demos[i % len(demos)] for i in range(tasks)]
+    start = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(benchmark_task, boundary_path, obstacle_path, cell_size) for boundary_path, obstacle_path in jobs]
+        lengths = [future.result() for future in futures]
+    elapsed = time.perf_counter() - start
+    print(f'{tasks} queries with cell size {cell_size} m in {elapsed:.2f} s ({elapsed / tasks:.3f} s per query)')
+    print(f'Path lengths: {lengths}')
+
 def main():
+    import matplotlib.pyplot as plt
+    plt.ion()  # Turn on interactive mode
     boundary = None
     obstacles = None
     grid = None
@@ -42,8 +102,8 @@ def main():
             print()
         print(f'* Graph Initialized: {graph is not None}', end="")
         if graph is not None:
-            print(f'{Fore.YELLOW}  Number of nodes: {len(graph.nodes)}')
-            print(f'  Number of edges: {len(graph.edges)}{Style.RESET_ALL}')
+            print(f'{Fore.YELLOW}  Number of nodes: {graph.number_of_nodes()}')
+            print(f'  Number of edges: {graph.number_of_edges()}{Style.RESET_ALL}')
         else:
             print()
         print('********************************************************')
@@ -64,7 +124,7 @@ def main():
             # Prompt user to select a boundary          
             boundary_file  = int(input('Enter the number for the boundary file: '))
             boundary_file_path = f'data/{files[int(boundary_file)-1]}'
-            boundary = gpd.read_file(boundary_file_path)
+            boundary = gpd.read_file(boundary_file_path, engine='pyogrio')
             # Check if boundary is a multipolygon
             if boundary.geometry.iloc[0].type == 'MultiPolygon':
                 print(f"{Fore.RED} \n Multipolygons are not allowed as boundaries. Please select a valid boundary file.{Style.RESET_ALL} \n")
@@ -75,7 +135,7 @@ def main():
             obstacle_file = int(input('Enter the number for the obstacle file: '))
             if obstacle_file:
                 obstacle_file_path = f'data/{files[int(obstacle_file)-1]}'
-                obstacles = gpd.read_file(obstacle_file_path)
+                obstacles = gpd.read_file(obstacle_file_path, engine='pyogrio')
             print("\n")
 
         elif option == '2':
@@ -91,17 +151,14 @@ def main():
             intersect = input('Do you want to intersect your grid with the boundary? (y/n): ').lower()
             # Promt the user to choose if he wants to clip his grid with boundary
             clip = input('Do you want to clip your grid with the boundary? (y/n): ').lower()
-            vector_grid = VectorGrid(boundary, cell_size, rotation, obstacles)
-            if intersect=='y':
-                vector_grid.intersect()
-            if clip=='y':
-                vector_grid.clip()
+            vector_grid = build_grid(boundary, obstacles, cell_size, rotation, intersect == 'y', clip == 'y')
             print(vector_grid.grid.head(100))  
             grid = vector_grid.return_grid()
+            grid_by_id = vector_grid.grid_by_id()
             vector_grid.visualize()
             # Generate graph
-            graph_grid = GraphGrid(grid)
-            graph = graph_grid.graph
+            graph_grid = GraphGrid(grid, cell_size)
+            graph = graph_grid
             print("\n")
 
         elif option == '3':
@@ -129,10 +186,10 @@ def main():
             else:
                 while True:
                     start_id = int(input('\n Enter the ID of the start point: '))
-                    if start_id not in grid['id'].values:
+                    if start_id not in grid_by_id.index:
                         print(f"{Fore.RED}\n Start point {start_id} does not exist. {Style.RESET_ALL}\n")
                         continue
-                    elif not grid.loc[grid['id'] == start_id, 'passable'].values[0]:
+                    elif not grid_by_id.at[start_id, 'passable']:
                         print(f"{Fore.RED}\n Start point {start_id} is not passable.  Select another start point.{Style.RESET_ALL}\n")
                         if len(grid) > 50:
                             print(grid.iloc[max(0, start_id-25):start_id+25])
@@ -142,10 +199,10 @@ def main():
                 
                 while True:
                     end_id = int(input('Enter the ID of the end point: '))
-                    if end_id not in grid['id'].values:
+                    if end_id not in grid_by_id.index:
                         print(f"{Fore.RED}\n End point {end_id} does not exist. {Style.RESET_ALL}\n")
                         continue
-                    elif not grid.loc[grid['id'] == end_id, 'passable'].values[0]:
+                    elif not grid_by_id.at[end_id, 'passable']:
                         print(f"{Fore.RED}\n End point {end_id} is not passable. Select another end point.{Style.RESET_ALL}\n")
                         if len(grid) > 50:
                             print(grid.iloc[max(0, end_id-25):end_id+25])
@@ -155,7 +212,7 @@ def main():
                                   
             print(f"Generating path from {start_id} to {end_id}")
             try:
-                path = graph_grid.find_path(start_id, end_id)           
+                path = solve(graph_grid, start_id, end_id)
                 if path is None:
                     print("No path could be found between the start and end points.")
                 else:
@@ -175,4 +232,12 @@ def main():
             print('Invalid option. Please try again.')
 
 if __name__ == '__main__':
-    main()
+    parser = argparse.ArgumentParser(description='Grid-Based Pathplaner with Graph and A* Algorithm')
+    parser.add_argument('--benchmark', type=int, metavar='N', help='run N headless queries on the demo data instead of the menu')
+    parser.add_argument('--cell-size', type=int, default=10, help='cell size in meters for the benchmark (default: 10)')
+    parser.add_argument('--workers', type=int, default=None, help='number of worker processes for the benchmark (default: all cores)')
+    args = parser.parse_args()
+    if args.benchmark:
+        benchmark(args.benchmark, args.cell_size, args.workers)
+    else:
+        main()
@@ -1,10 +1,42 @@
 import math
+import numpy as np
+import shapely
+
+def utm_epsg(gdf):
+    # Determine the UTM zone number for the centroid of the first geometry
+    centroid = gdf.geometry.iloc[0].centroid
+    utm_zone = math.floor((centroid.x + 180) / 6) + 1
+    # Return the EPSG code of the zone, 326xx on the northern and 327xx on the southern hemisphere
+    return f'EPSG:326{utm_zone:02d}' if centroid.y >= 0 else f'EPSG:327{utm_zone:02d}'
 
 def convert_to_utm(polygon):
-    # Determine the UTM zone number for the polygon's centroid
-    utm_zone = math.floor((polygon.centroid.x.iloc[0] + 180) / 6) + 1
-    # Create a string for the UTM zone's EPSG code
-    utm_crs = f'EPSG:326{str(utm_zone).zfill(2)}' if polygon.centroid.y.iloc[0] >= 0 else f'EPSG:327{str(utm_zone).zfill(2)}'
-    # Reproject the polygon to the UTM zone
-    polygon_utm = polygon.to_crs(utm_crs)
-    return polygon_utm
\ No newline at end of file
+    # Reproject the polygon to its UTM zone
+    polygon_utm = polygon.to_crs(utm_epsg(polygon))
+    return polygon_utm
+
+def rotate_xy(x, y, angle, origin):
+    # Rotate the coordinate arrays counter-clockwise by angle degrees around the origin
+    cos_t, sin_t = math.cos(math.radians(angle)), math.sin(math.radians(angle))
+    ox, oy = origin
+    dx, dy = np.asarray(x) - ox, np.asarray(y) - oy
+    return cos_t * dx - sin_t * dy + ox, sin_t * dx + cos_t * dy + oy
+
+def plot_cells(ax, cells, facecolors):
+    # Draw all cells as a single PolyCollection with one face color per cell
+    from matplotlib.collections import PolyCollection
+    # Clipping can split cells into several parts, draw the outline of each polygon part
+    parts, cell_index = shapely.get_parts(cells, return_index=True)
+    rings = shapely.get_exterior_ring(parts)
+    polygonal = ~shapely.is_missing(rings)
+    coords, ring_index = shapely.get_coordinates(rings[polygonal], return_index=True)
+    counts = np.bincount(ring_index, minlength=polygonal.sum())
+    if len(counts) and (counts == counts[0]).all():
+        # Unclipped cells all have the same number of vertices and fit in one contiguous array
+        verts = coords.reshape(len(counts), counts[0], 2)
+    else:
+        verts = np.split(coords, np.cumsum(counts)[:-1])
+    collection = PolyCollection(verts, facecolors=np.asarray(facecolors)[cell_index[polygonal]], edgecolors='black')
+    ax.add_collection(collection)
+    ax.autoscale_view()
+    ax.set_aspect('equal')
+    return collection
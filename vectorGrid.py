@@ -1,12 +1,10 @@
 from typing import Optional, Tuple
 import geopandas as gpd
+import numpy as np
+import shapely
 import pyproj
-from shapely.geometry import Polygon, box, Point
-from shapely.affinity import rotate
-from shapely.ops import nearest_points
-import math
-import matplotlib.pyplot as plt
-from matplotlib.patches import Patch
+from shapely.geometry import Polygon
+from scipy.spatial import cKDTree
 from utils import *
 
 
@@ -26,6 +24,8 @@ class VectorGrid:
         The obstacle within the grid.
     grid : gpd.GeoDataFrame
         The grid itself.
+    obstacle_epoch : int
+        The number of times the obstacles of the grid have changed.
 
     Methods
     -------
@@ -33,6 +33,8 @@ class VectorGrid:
         Checks and converts the CRS of a GeoDataFrame.
     create_vector_grid():
         Creates the vector grid.
+    passable_mask(cells) -> np.ndarray:
+        Returns a boolean array that is False for every cell intersecting an obstacle.
     clip():
         Clips the grid with the polygon.
     intersect():
@@ -45,9 +47,15 @@ class VectorGrid:
         Visualizes the grid.
     rotate(rotation: float):
         Rotates the grid.
+    grid_by_id() -> gpd.GeoDataFrame:
+        Returns the grid indexed by cell ID.
+    cell_tree() -> shapely.STRtree:
+        Returns a spatial index of the grid cells.
     return_grid() -> gpd.GeoDataFrame:
         Returns the grid.
-    closest_cell_id(utm_coordinates: Tuple[float, float]) -> int:
+    closest_cell_ids(utm_coordinates: np.ndarray) -> np.ndarray:
+        Returns the IDs of the cells closest to an (N, 2) array of UTM coordinates.
+    closest_cell_id(utm_coordinates: Tuple[float, float]) -> Optional[int]:
         Returns the ID of the cell closest to the given UTM coordinates.
     """
     def __init__(self, polygon: gpd.GeoDataFrame, cell_size: int = 50, rotation: Optional[float] = None, obstacle: Optional[gpd.GeoDataFrame] = None):
@@ -56,87 +64,120 @@ class VectorGrid:
         self.rotation = rotation
         self.obstacle = self.check_and_convert_crs(obstacle) if obstacle is not None else None
         self.grid = self.create_vector_grid()
+        self._reset_indexes()
 
     def check_and_convert_crs(self, gdf: gpd.GeoDataFrame) -> gpd.GeoDataFrame:
         """Checks and converts the CRS of a GeoDataFrame."""
         # Check if the GeoDataFrame's CRS is projected. If not, reproject it to the appropriate UTM zone.
         if not gdf.crs.is_projected:
-            # Determine the UTM zone number for the GeoDataFrame's centroid
-            utm_zone = math.floor((gdf.centroid.x.iloc[0] + 180) / 6) + 1
-            # Create a string for the UTM zone's EPSG code
-            utm_crs = f'EPSG:326{str(utm_zone).zfill(2)}' if gdf.centroid.y.iloc[0] >= 0 else f'EPSG:327{str(utm_zone).zfill(2)}'
-            # Reproject the GeoDataFrame to the UTM zone
-            gdf = gdf.to_crs(utm_crs)
+            gdf = gdf.to_crs(utm_epsg(gdf))
         return gdf
 
     def create_vector_grid(self):
         """Creates the vector grid."""
         # Calculate the buffer as the maximum distance from the centroid to the polygon's vertices
-        buffer = max(self.polygon.centroid.iloc[0].distance(Point(coord)) for coord in self.polygon.geometry.iloc[0].exterior.coords)
-
-        # Get the bounding box of the polygon and apply the buffer
-        minx, miny, maxx, maxy = self.polygon.buffer(buffer).bounds.iloc[0]
-
-        # Create the grid
-        x_coords = list(range(int(minx), int(maxx), self.cell_size))
-        y_coords = list(range(int(miny), int(maxy), self.cell_size))
-        grid_polys = []
-        for x in x_coords:
-            for y in y_coords:
-                # Create a polygon for the cell
-                cell = box(x, y, x+self.cell_size, y+self.cell_size)
-                grid_polys.append(cell)
-
-        # Create a GeoDataFrame
-        grid = gpd.GeoDataFrame(grid_polys, columns=['geometry'], crs=self.polygon.crs)  
-                
-        # Rotate the entire grid
+        coords = np.asarray(self.polygon.geometry.iloc[0].exterior.coords)
+        origin = self.polygon.centroid.iloc[0].coords[0]
+        buffer = float(np.hypot(coords[:, 0] - origin[0], coords[:, 1] - origin[1]).max())
+
+        # Get the bounding box of the polygon and expand it by the buffer
+        minx, miny, maxx, maxy = self.polygon.total_bounds + np.array([-buffer, -buffer, buffer, buffer])
+
+        # Create the lower left corner of every cell and keep its integer position in the lattice
+        x_coords = np.arange(int(minx), int(maxx), self.cell_size)
+        y_coords = np.arange(int(miny), int(maxy), self.cell_size)
+        X, Y = np.meshgrid(x_coords, y_coords, indexing='ij')
+        IX, IY = np.meshgrid(np.arange(len(x_coords)), np.arange(len(y_coords)), indexing='ij')
+        x, y = X.ravel(), Y.ravel()
+
+        # Lay out the ring of each cell (4 corners plus the closing vertex) followed by its center,
+        # so a rotation moves the cells and their cached centers in a single pass
+        coords = np.empty((len(x), 6, 2))
+        coords[:, :, 0] = x[:, None] + self.cell_size * np.array([0, 1, 1, 0, 0, 0.5])
+        coords[:, :, 1] = y[:, None] + self.cell_size * np.array([0, 0, 1, 1, 0, 0.5])
         if self.rotation is not None:
-          grid['geometry'] = grid['geometry'].rotate(self.rotation, origin=self.polygon.centroid.iloc[0], use_radians=False)
+            coords[:, :, 0], coords[:, :, 1] = rotate_xy(coords[:, :, 0], coords[:, :, 1], self.rotation, origin)
 
-        # If an obstacle is provided, update the 'passable' attribute of the cells
-        if self.obstacle is not None:
-            grid['passable'] = ~grid['geometry'].apply(lambda cell: any(cell.intersects(obstacle) for obstacle in self.obstacle.geometry))
-        else:
-            grid['passable'] = True
-        
-        # Add an 'id' column
-        grid['id'] = range(len(grid))
+        # Create all polygons at once and mark the cells intersecting an obstacle
+        grid_polys = shapely.polygons(coords[:, :5])
+        passable = self.passable_mask(grid_polys)
+
+        # Create the GeoDataFrame from all columns at once
+        grid = gpd.GeoDataFrame({'geometry': grid_polys,
+                                 'ix': IX.ravel(),
+                                 'iy': IY.ravel(),
+                                 'passable': passable,
+                                 'id': np.arange(len(x)),
+                                 'center_x': coords[:, 5, 0],
+                                 'center_y': coords[:, 5, 1]}, crs=self.polygon.crs)
+
+        # Count obstacle changes so graphs built on this grid can tell when their passable cells are stale
+        grid.attrs['obstacle_epoch'] = 0
         return grid
 
+    @property
+    def obstacle_epoch(self) -> int:
+        """The number of times the obstacles of the grid have changed."""
+        return self.grid.attrs.get('obstacle_epoch', 0)
+
+    def passable_mask(self, cells) -> np.ndarray:
+        """Returns a boolean array that is False for every cell intersecting an obstacle."""
+        passable = np.ones(len(cells), dtype=bool)
+        if self.obstacle is not None:
+            # Query all cells against a spatial index of the obstacles in one call
+            tree = shapely.STRtree(self.obstacle.geometry.values)
+            cell_idx, _ = tree.query(cells, predicate='intersects')
+            passable[np.unique(cell_idx)] = False
+        return passable
+
     def clip(self):
         """Clips the grid with the polygon."""
-        self.grid = gpd.clip(self.grid, self.polygon)
+        polygon = self.polygon.geometry.iloc[0]
+        # Only the cells on the polygon's edge need to be cut, the cells inside it are kept as they are
+        candidates = np.sort(self.cell_tree().query(polygon, predicate='intersects'))
+        inside = np.isin(candidates, self.cell_tree().query(polygon, predicate='contains_properly'))
+        cells = np.asarray(self.grid.geometry.values)[candidates]
+        cells[~inside] = shapely.intersection(cells[~inside], polygon)
+        keep = ~shapely.is_empty(cells)
+        self.grid = self.grid.iloc[candidates[keep]].reset_index(drop=True)
+        self.grid['geometry'] = gpd.GeoSeries(cells[keep], crs=self.grid.crs)
         # Add an 'id' column
         self.grid['id'] = range(len(self.grid))
+        self._reset_indexes()
 
     def intersect(self):
         """Intersects the grid with the polygon."""
-        self.grid = self.grid[self.grid.intersects(self.polygon.geometry[0])]
+        candidates = self.cell_tree().query(self.polygon.geometry.iloc[0], predicate='intersects')
+        self.grid = self.grid.iloc[np.sort(candidates)].reset_index(drop=True)
         # Add an 'id' column
         self.grid['id'] = range(len(self.grid))
+        self._reset_indexes()
 
     def add_obstacle(self, obstacle: gpd.GeoDataFrame):
         """Adds an obstacle to the grid."""
         self.obstacle = obstacle
         # Update self.grid to account for the obstacle
-        self.grid['passable'] = ~self.grid['geometry'].apply(lambda cell: any(cell.intersects(obstacle) for obstacle in self.obstacle.geometry))
+        self.grid['passable'] = self.passable_mask(self.grid.geometry.values)
+        self.grid.attrs['obstacle_epoch'] = self.obstacle_epoch + 1
+        self._reset_indexes()
 
     def clear_obstacle(self):
         """Clears the obstacle from the grid."""
         self.obstacle = None
         # Update self.grid to remove the obstacle
         self.grid['passable'] = True
+        self.grid.attrs['obstacle_epoch'] = self.obstacle_epoch + 1
+        self._reset_indexes()
 
     def visualize(self, highlight_cell_id: Optional[int] = None):
         """Visualizes the grid."""
+        import matplotlib.pyplot as plt
+        from matplotlib.patches import Patch
         fig, ax = plt.subplots()
-        if self.grid['passable'].any():  # If there are any passable cells
-            self.grid[self.grid['passable']].plot(ax=ax, color='green', edgecolor='black')
-        if (~self.grid['passable']).any():  # If there are any impassable cells
-            self.grid[~self.grid['passable']].plot(ax=ax, color='red', edgecolor='black')
+        colors = np.where(self.grid['passable'].to_numpy(dtype=bool), 'green', 'red').astype(object)
         if highlight_cell_id is not None:  # If a cell ID is provided to highlight
-            self.grid[self.grid['id'] == highlight_cell_id].plot(ax=ax, color='gold', edgecolor='black')
+            colors[self.grid_by_id().index.get_loc(highlight_cell_id)] = 'gold'
+        plot_cells(ax, self.grid.geometry.values, colors)
         self.polygon.boundary.plot(ax=ax, color='violet')
         legend_elements = [Patch(facecolor='green', edgecolor='black', label='Passable'),
                            Patch(facecolor='red', edgecolor='black', label='Impassable'),
@@ -147,31 +188,66 @@ class VectorGrid:
         plt.ylabel('Northing (m)')
         plt.show()
 
+    def _rotate_cells(self, cells, rotation: float):
+        """Rotates all cells around the polygon's centroid in one vectorized transform of their coordinates."""
+        origin = self.polygon.centroid.iloc[0].coords[0]
+        return shapely.transform(cells, lambda coords: np.column_stack(rotate_xy(coords[:, 0], coords[:, 1], rotation, origin)))
+
     def rotate(self, rotation: float):
         """Rotates the grid."""
         self.rotation = rotation
         # Update self.grid to account for the new rotation
-        self.grid['geometry'] = self.grid['geometry'].rotate(self.rotation, origin=self.polygon.centroid.iloc[0], use_radians=False)
+        self.grid['geometry'] = gpd.GeoSeries(self._rotate_cells(self.grid.geometry.values, self.rotation), index=self.grid.index, crs=self.grid.crs)
+        self.grid['center_x'], self.grid['center_y'] = rotate_xy(self.grid['center_x'].to_numpy(), self.grid['center_y'].to_numpy(), self.rotation, self.polygon.centroid.iloc[0].coords[0])
+        self._reset_indexes()
+
+    def _reset_indexes(self):
+        """Drops the lookup structures derived from the grid after it changed."""
+        self._kdtree = None
+        self._grid_by_id = None
+        self._cell_tree = None
+
+    def cell_tree(self) -> shapely.STRtree:
+        """Returns a spatial index of the grid cells, positions in it match the rows of the grid."""
+        if self._cell_tree is None:
+            self._cell_tree = shapely.STRtree(self.grid.geometry.values)
+        return self._cell_tree
+
+    def grid_by_id(self) -> gpd.GeoDataFrame:
+        """Returns the grid indexed by cell ID for constant time lookups."""
+        if self._grid_by_id is None:
+            self._grid_by_id = self.grid.set_index('id', drop=False)
+        return self._grid_by_id
 
     def return_grid(self) -> gpd.GeoDataFrame:
         """Returns the grid."""
         return self.grid
 
-    def closest_cell_id(self, utm_coordinates: Tuple[float, float]) -> int:
-        """Returns the ID of the passable cell closest to the given UTM coordinates."""
-        # Create a Point from the UTM coordinates
-        point = Point(utm_coordinates)
-    
-        # Create a MultiPoint object from the centroids of all passable cells
-        multipoint = self.grid[self.grid['passable']]['geometry'].centroid.unary_union
-    
-        # Find the nearest point in the MultiPoint object to the given point
-        nearest = nearest_points(point, multipoint)[1]
-    
-        # Find the cell whose centroid is the nearest point
-        closest_cell_id = self.grid[self.grid['geometry'].centroid == nearest]['id'].values[0]
-    
-        return closest_cell_id
+    def closest_cell_ids(self, utm_coordinates: np.ndarray) -> np.ndarray:
+        """Returns the IDs of the passable cells closest to an (N, 2) array of UTM coordinates, -1 for points outside the polygon."""
+        utm_coordinates = np.asarray(utm_coordinates, dtype=float).reshape(-1, 2)
+
+        # Build a KD-tree over the centroids of all passable cells once and reuse it for every query
+        if self._kdtree is None:
+            passable = self.grid[self.grid['passable']]
+            self._passable_ids = passable['id'].to_numpy()
+            self._kdtree = cKDTree(passable[['center_x', 'center_y']].to_numpy())
+
+        # Test all points against the polygon in one call
+        inside = shapely.contains_xy(self.polygon.geometry.iloc[0], utm_coordinates[:, 0], utm_coordinates[:, 1])
+
+        # Find the passable cells whose centroids are nearest to the points inside the polygon
+        closest_cell_ids = np.full(len(utm_coordinates), -1, dtype=np.int64)
+        if inside.any():
+            _, nearest = self._kdtree.query(utm_coordinates[inside])
+            closest_cell_ids[inside] = self._passable_ids[nearest]
+
+        return closest_cell_ids
+
+    def closest_cell_id(self, utm_coordinates: Tuple[float, float]) -> Optional[int]:
+        """Returns the ID of the passable cell closest to the given UTM coordinates, or None if they are outside the polygon."""
+        closest_cell_id = int(self.closest_cell_ids(utm_coordinates)[0])
+        return closest_cell_id if closest_cell_id >= 0 else None
 
 # Tests
 # Enter the UTM coordinates of the start point (separated by a comma): 5133699,4645005